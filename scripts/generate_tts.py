@@ -4,358 +4,716 @@ TTS Generation Script for Conversation Simulation
 Generates audio files for Customer and Seller voices using gTTS or pyttsx3
 """
 
+import asyncio
+import base64
+import functools
+import hashlib
+import importlib.util
 import json
+import multiprocessing
 import os
+import re
+import shutil
+import time
+import urllib.request
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
-from typing import List, Dict
+from types import MappingProxyType
+from typing import List, Dict, Mapping, Optional, Sequence, Tuple
 import argparse
 
+# The TTS engines are only imported once an engine is actually used:
+# pyttsx3 loads the platform speech backend at import time.
+GTTS_AVAILABLE = importlib.util.find_spec('gtts') is not None
+if not GTTS_AVAILABLE:
+    print("Warning: gTTS not available. Install with: pip install gtts")
+
+PYTTSX3_AVAILABLE = importlib.util.find_spec('pyttsx3') is not None
+if not PYTTSX3_AVAILABLE:
+    print("Warning: pyttsx3 not available. Install with: pip install pyttsx3")
+
+gTTS = None
+pyttsx3 = None
+
+
+def _load_gtts():
+    """Import gTTS on first use"""
+    global gTTS
+    if gTTS is None:
+        from gtts import gTTS as _gTTS
+        gTTS = _gTTS
+    return gTTS
+
+
+def _load_pyttsx3():
+    """Import pyttsx3 on first use"""
+    global pyttsx3
+    if pyttsx3 is None:
+        import pyttsx3 as _pyttsx3
+        pyttsx3 = _pyttsx3
+    return pyttsx3
+
 try:
-    from gtts import gTTS
-    GTTS_AVAILABLE = True
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    _loads = orjson.loads
 except ImportError:
-    GTTS_AVAILABLE = False
-    print("Warning: gTTS not available. Install with: pip install gtts")
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode()
 
+    _loads = json.loads
+
+# The concurrent gTTS path needs httpx with HTTP/2 support (the h2 package)
 try:
-    import pyttsx3
-    PYTTSX3_AVAILABLE = True
+    import aiofiles
+    import httpx
+    HTTPX_AVAILABLE = importlib.util.find_spec('h2') is not None
 except ImportError:
-    PYTTSX3_AVAILABLE = False
-    print("Warning: pyttsx3 not available. Install with: pip install pyttsx3")
+    HTTPX_AVAILABLE = False
+
+# Audio payload inside a Google Translate batchexecute response line
+GTTS_AUDIO_RE = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+
+def _decode_gtts_line(line: str, text: str) -> Optional[bytes]:
+    """Decode the audio chunk in a batchexecute response line, if it carries one"""
+    if 'jQ1olc' not in line:
+        return None
+    match = GTTS_AUDIO_RE.search(line)
+    if not match:
+        raise RuntimeError(f"No audio in gTTS response for: {text[:50]}")
+    return base64.b64decode(match.group(1))
+
+
+@dataclass(slots=True)
+class OrderItem:
+    name: str
+    quantity: int
+    price: float
+
+
+@dataclass(slots=True)
+class OrderAction:
+    type: str
+    items: List[OrderItem] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class Payment:
+    amount: float
+    change: float
+    method: str = 'CASH'
+
+
+@dataclass(slots=True)
+class Message:
+    id: str
+    role: str
+    text: str
+    order_action: Optional[OrderAction] = None
+    payment_received: Optional[Payment] = None
+
+    def to_dict(self) -> Dict:
+        """Serialize with the camelCase keys used in conversations.json"""
+        data = {'id': self.id, 'role': self.role, 'text': self.text}
+        if self.order_action:
+            data['orderAction'] = asdict(self.order_action)
+        if self.payment_received:
+            data['paymentReceived'] = asdict(self.payment_received)
+        return data
+
+
+# pyttsx3 engine owned by the current pool worker process
+_pyttsx3_engine = None
+
+
+def _pyttsx3_worker_init():
+    """Create one pyttsx3 engine per worker process"""
+    global _pyttsx3_engine
+    _pyttsx3_engine = _load_pyttsx3().init()
+
+
+def _pyttsx3_worker(args):
+    """Synthesize a single message in a pool worker. Returns an error message or None."""
+    text, filename, voice_idx, rate, output_dir = args
+    try:
+        # Voices are looked up by index because pyttsx3 voice objects do not pickle
+        voices = _pyttsx3_engine.getProperty('voices')
+        if voices:
+            _pyttsx3_engine.setProperty('voice', voices[min(voice_idx, len(voices) - 1)].id)
+        _pyttsx3_engine.setProperty('rate', rate)
+
+        output_path = Path(output_dir) / filename
+        _pyttsx3_engine.save_to_file(text, str(output_path))
+        _pyttsx3_engine.runAndWait()
+        return None
+    except Exception as e:
+        return str(e)
+
+
+def _link_or_copy(source: Path, target: Path):
+    """Hardlink target to source, copying on filesystems without hardlinks"""
+    target.unlink(missing_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+DEFAULT_CACHE_DIR = Path(__file__).parent / ".tts_cache"
+DEFAULT_MAX_CACHE_BYTES = 100 * 1024 * 1024
 
 
 class TTSGenerator:
-    def __init__(self, output_dir: str = "public/tts"):
+    def __init__(self, output_dir: str = "public/tts", cache_dir: Optional[str] = None,
+                 max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
-        # Initialize pyttsx3 engine if available
+        # Content-addressed audio cache shared across runs and scenarios
+        self.cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_index_path = self.cache_dir / "cache_index.json"
+        self.max_cache_bytes = max_cache_bytes
+        self.cache_index = self._load_cache_index()
+        self._cache_index_dirty = False
+
+        # Per-scenario progress files, kept out of output_dir so an
+        # interrupted run never leaves them in the served directory
+        self.progress_dir = self.cache_dir / "progress"
+        self.progress_dir.mkdir(exist_ok=True)
+
+        # Audio already written during this run, so identical messages in
+        # other scenarios are linked instead of synthesized again
+        self.synthesized: Dict[str, Path] = {}
+
+        # Keep-alive session for the sequential gTTS path, created on first
+        # use so one TLS handshake is shared by every message
+        self._session = None
+
+        # HTTP/2 client that concurrent gTTS requests multiplex over, created
+        # on first use by the async path
+        self._client = None
+
+        # pyttsx3 engine, initialized on first use by _init_pyttsx3
         self.engine = None
-        if PYTTSX3_AVAILABLE:
-            self.engine = pyttsx3.init()
-            voices = self.engine.getProperty('voices')
-            self.customer_voice = voices[0] if len(voices) > 0 else None
-            self.seller_voice = voices[1] if len(voices) > 1 else voices[0]
+        self.customer_voice = None
+        self.seller_voice = None
+
+    def _init_pyttsx3(self):
+        """Initialize the pyttsx3 engine and voices if that has not happened yet"""
+        if self.engine or not PYTTSX3_AVAILABLE:
+            return
+        self.engine = _load_pyttsx3().init()
+        voices = self.engine.getProperty('voices')
+        self.customer_voice = voices[0] if len(voices) > 0 else None
+        self.seller_voice = voices[1] if len(voices) > 1 else voices[0]
+
+    def _gtts_session(self):
+        """Shared keep-alive requests.Session for the sequential gTTS path"""
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            self._session = requests.Session()
+            self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        return self._session
+
+    def _http_client(self):
+        """Shared HTTP/2 client for the concurrent gTTS path"""
+        if self._client is None:
+            if not HTTPX_AVAILABLE:
+                raise RuntimeError("httpx with HTTP/2 support is not installed")
+            self._client = httpx.AsyncClient(
+                http2=True,
+                timeout=30,
+                # Customers and sellers use different origins (see _gtts_params), so
+                # a single connection would serialize them. HTTP/2 still multiplexes
+                # each origin over one connection; the cap matches the sequential
+                # path's pool and only matters when HTTP/1.1 is negotiated.
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=16)
+            )
+        return self._client
+
+    async def aclose(self):
+        """Close the shared HTTP client"""
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _cache_key(text: str, **params) -> str:
+        """Stable hash of the text and every parameter that affects the audio"""
+        # Always stdlib json so keys match whether or not orjson is installed
+        payload = json.dumps({'text': text, **params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _load_cache_index(self) -> Dict:
+        """Load the cache index, dropping entries whose audio file is gone"""
+        if not self.cache_index_path.exists():
+            return {}
+        try:
+            index = _loads(self.cache_index_path.read_bytes())
+        except (OSError, ValueError):
+            return {}
+        return {k: v for k, v in index.items() if (self.cache_dir / v['path']).exists()}
+
+    def _save_cache_index(self):
+        """Write the cache index if it changed since it was last saved"""
+        if self._cache_index_dirty:
+            self.cache_index_path.write_bytes(_dumps(self.cache_index))
+            self._cache_index_dirty = False
+
+    def _cache_fetch(self, key: str, output_path: Path) -> bool:
+        """Copy a cached file to output_path. Returns False on a cache miss."""
+        entry = self.cache_index.get(key)
+        if not entry:
+            return False
+
+        cached_path = self.cache_dir / entry['path']
+        if not cached_path.exists():
+            del self.cache_index[key]
+            self._cache_index_dirty = True
+            return False
+
+        shutil.copyfile(cached_path, output_path)
+        entry['last_used'] = time.time()
+        self._cache_index_dirty = True
+        print(f"Cached: {output_path}")
+        return True
+
+    def _cache_store(self, key: str, output_path: Path):
+        """Add a freshly generated file to the cache and evict past the size limit"""
+        cached_path = self.cache_dir / f"{key}.mp3"
+        shutil.copyfile(output_path, cached_path)
+        self.cache_index[key] = {
+            'path': cached_path.name,
+            'last_used': time.time(),
+            'size': cached_path.stat().st_size,
+        }
+        self._evict_cache()
+        self._cache_index_dirty = True
+
+    def _evict_cache(self):
+        """Delete least recently used entries until the cache fits max_cache_bytes"""
+        total = sum(entry['size'] for entry in self.cache_index.values())
+        by_age = sorted(self.cache_index.items(), key=lambda kv: kv[1]['last_used'])
+        for key, entry in by_age:
+            if total <= self.max_cache_bytes:
+                break
+            (self.cache_dir / entry['path']).unlink(missing_ok=True)
+            total -= entry['size']
+            del self.cache_index[key]
+
+    def _output_path(self, filename: str) -> Path:
+        """Output path for filename, unlinked first so a hardlinked duplicate
+        from an earlier run is never overwritten in place"""
+        output_path = self.output_dir / filename
+        output_path.unlink(missing_ok=True)
+        return output_path
+
+    def _fetch_existing(self, key: str, output_path: Path) -> bool:
+        """Reuse audio from this run or the cache. Returns False if it must be synthesized."""
+        source = self.synthesized.get(key)
+        if source and source != output_path and source.exists():
+            _link_or_copy(source, output_path)
+            print(f"Linked: {output_path}")
+            return True
+        if self._cache_fetch(key, output_path):
+            self.synthesized[key] = output_path
+            return True
+        return False
+
+    def _store_generated(self, key: str, output_path: Path):
+        self.synthesized[key] = output_path
+        self._cache_store(key, output_path)
+
+    @staticmethod
+    def _gtts_params(role: str) -> Dict:
+        """gTTS voice settings. Customer: US accent (com), Seller: Australian accent (com.au)"""
+        return {'lang': 'en', 'slow': False, 'tld': 'com' if role == 'customer' else 'com.au'}
 
     def generate_with_gtts(self, text: str, filename: str, lang: str = 'en', slow: bool = False, tld: str = 'com'):
         """Generate TTS using Google Text-to-Speech"""
         if not GTTS_AVAILABLE:
             raise RuntimeError("gTTS is not installed")
 
-        tts = gTTS(text=text, lang=lang, slow=slow, tld=tld)
-        output_path = self.output_dir / filename
-        tts.save(str(output_path))
+        output_path = self._output_path(filename)
+        key = self._cache_key(text, engine='gtts', lang=lang, slow=slow, tld=tld)
+        if self._fetch_existing(key, output_path):
+            return str(output_path)
+
+        # gTTS builds the requests; they are sent on the shared session
+        # rather than the new session gTTS opens for every save()
+        tts = _load_gtts()(text=text, lang=lang, slow=slow, tld=tld)
+        session = self._gtts_session()
+        with open(output_path, 'wb') as f:
+            for request in tts._prepare_requests():
+                response = session.send(request, timeout=30, proxies=urllib.request.getproxies())
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    audio = _decode_gtts_line(line.decode('utf-8'), text)
+                    if audio:
+                        f.write(audio)
+
+        self._store_generated(key, output_path)
+        print(f"Generated: {output_path}")
+        return str(output_path)
+
+    async def generate_with_gtts_async(self, text: str, filename: str,
+                                       lang: str = 'en', slow: bool = False, tld: str = 'com'):
+        """Generate TTS using Google Text-to-Speech over the shared HTTP/2 client"""
+        if not GTTS_AVAILABLE:
+            raise RuntimeError("gTTS is not installed")
+        client = self._http_client()
+
+        output_path = self._output_path(filename)
+        key = self._cache_key(text, engine='gtts', lang=lang, slow=slow, tld=tld)
+        if self._fetch_existing(key, output_path):
+            return str(output_path)
+
+        # gTTS still tokenizes the text and packages the batchexecute RPC;
+        # only the transport is replaced so connections are reused.
+        tts = _load_gtts()(text=text, lang=lang, slow=slow, tld=tld)
+
+        async with aiofiles.open(output_path, 'wb') as f:
+            for request in tts._prepare_requests():
+                headers = {k: v for k, v in request.headers.items() if k.lower() != 'content-length'}
+                async with client.stream('POST', request.url, content=request.body,
+                                          headers=headers) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        audio = _decode_gtts_line(line, text)
+                        if audio:
+                            await f.write(audio)
+
+        self._store_generated(key, output_path)
         print(f"Generated: {output_path}")
         return str(output_path)
 
     def generate_with_pyttsx3(self, text: str, filename: str, voice_id: str = None, rate: int = 150):
         """Generate TTS using pyttsx3 (offline)"""
-        if not PYTTSX3_AVAILABLE or not self.engine:
+        self._init_pyttsx3()
+        if not self.engine:
             raise RuntimeError("pyttsx3 is not installed or initialized")
 
+        output_path = self._output_path(filename)
+        key = self._cache_key(text, engine='pyttsx3', voice_id=voice_id, rate=rate)
+        if self._fetch_existing(key, output_path):
+            return str(output_path)
+
         if voice_id:
             self.engine.setProperty('voice', voice_id)
         self.engine.setProperty('rate', rate)
 
-        output_path = self.output_dir / filename
         self.engine.save_to_file(text, str(output_path))
         self.engine.runAndWait()
+        self._store_generated(key, output_path)
         print(f"Generated: {output_path}")
         return str(output_path)
 
-    def generate_conversation(self, conversation: List[Dict], scenario_name: str = '', use_gtts: bool = True):
+    @staticmethod
+    def _message_filename(message: Message, index: int, scenario_name: str = ''):
+        """Return (msg_id, role, text, filename) for a conversation message"""
+        msg_id = message.id or f'msg-{index}'
+        role = message.role
+        text = message.text
+
+        # Generate filename with scenario prefix to avoid overwrites
+        filename = f"{scenario_name}_{msg_id}_{role}.mp3" if scenario_name else f"{msg_id}_{role}.mp3"
+        return msg_id, role, text, filename
+
+    @staticmethod
+    def _build_result(message: Message, msg_id: str, role: str, text: str, filename: str) -> Dict:
+        """Build the metadata entry for a generated message"""
+        return {
+            'id': msg_id,
+            'role': role,
+            'text': text,
+            'audioPath': f'/tts/{filename}',
+            'filename': filename,
+            **{k: v for k, v in message.to_dict().items() if k not in ['id', 'role', 'text']}
+        }
+
+    def progress_path(self, scenario_name: str = '') -> Path:
+        """Per-scenario JSONL file that results are written to as they finish"""
+        return self.progress_dir / f"{scenario_name or 'conversation'}.jsonl"
+
+    @staticmethod
+    def _write_progress(progress, index: int, result: Dict):
+        """Append [index, result] so lines can be written in completion order"""
+        progress.write(b'[%d,' % index + _dumps(result) + b']\n')
+        progress.flush()
+
+    def generate_conversation(self, conversation: Sequence[Message], scenario_name: str = '', use_gtts: bool = True):
         """Generate TTS for entire conversation"""
+        if not (use_gtts and GTTS_AVAILABLE) and PYTTSX3_AVAILABLE:
+            return self.generate_conversation_pyttsx3(conversation, scenario_name=scenario_name)
+
         results = []
+        with open(self.progress_path(scenario_name), 'wb') as progress:
+            for i, message in enumerate(conversation):
+                msg_id, role, text, filename = self._message_filename(message, i, scenario_name)
 
+                if not text:
+                    continue
+
+                try:
+                    if use_gtts and GTTS_AVAILABLE:
+                        self.generate_with_gtts(text, filename, **self._gtts_params(role))
+                    else:
+                        print(f"Error: No TTS engine available for: {text[:50]}...")
+                        continue
+
+                    result = self._build_result(message, msg_id, role, text, filename)
+                    results.append(result)
+                    self._write_progress(progress, i, result)
+                except Exception as e:
+                    print(f"Error generating TTS for message {msg_id}: {e}")
+
+        self._save_cache_index()
+        return results
+
+    def generate_conversation_pyttsx3(self, conversation: Sequence[Message], scenario_name: str = ''):
+        """Generate pyttsx3 audio for an entire conversation across a process pool"""
+        self._init_pyttsx3()
+        if not self.engine:
+            raise RuntimeError("pyttsx3 is not installed or initialized")
+
+        results = {}
+        jobs = {}
+        duplicates = []
         for i, message in enumerate(conversation):
-            msg_id = message.get('id', f'msg-{i}')
-            role = message.get('role', 'customer')
-            text = message.get('text', '')
+            msg_id, role, text, filename = self._message_filename(message, i, scenario_name)
 
             if not text:
                 continue
 
-            # Generate filename with scenario prefix to avoid overwrites
-            filename = f"{scenario_name}_{msg_id}_{role}.mp3" if scenario_name else f"{msg_id}_{role}.mp3"
-
-            try:
-                if use_gtts and GTTS_AVAILABLE:
-                    # Customer: US accent (com), Seller: Australian accent (com.au)
-                    tld = 'com' if role == 'customer' else 'com.au'
-                    slow = False
-                    output_path = self.generate_with_gtts(text, filename, slow=slow, tld=tld)
-                elif PYTTSX3_AVAILABLE:
-                    voice = self.customer_voice if role == 'customer' else self.seller_voice
-                    rate = 140 if role == 'customer' else 160
-                    output_path = self.generate_with_pyttsx3(
-                        text, filename,
-                        voice_id=voice.id if voice else None,
-                        rate=rate
-                    )
-                else:
-                    print(f"Error: No TTS engine available for: {text[:50]}...")
+            voice = self.customer_voice if role == 'customer' else self.seller_voice
+            voice_idx = 0 if role == 'customer' else 1
+            rate = 140 if role == 'customer' else 160
+            key = self._cache_key(text, engine='pyttsx3', voice_id=voice.id if voice else None, rate=rate)
+            output_path = self._output_path(filename)
+
+            results[i] = self._build_result(message, msg_id, role, text, filename)
+            if key in jobs:
+                # Synthesize each distinct message once and link the repeats
+                duplicates.append((i, key, output_path))
+            elif not self._fetch_existing(key, output_path):
+                jobs[key] = (i, (text, filename, voice_idx, rate, str(self.output_dir)))
+
+        if jobs:
+            processes = min(len(jobs), multiprocessing.cpu_count())
+            with multiprocessing.Pool(processes=processes, initializer=_pyttsx3_worker_init) as pool:
+                errors = pool.map(_pyttsx3_worker, [job_args for _, job_args in jobs.values()])
+
+            for (key, (i, job_args)), error in zip(jobs.items(), errors):
+                output_path = self.output_dir / job_args[1]
+                if error:
+                    print(f"Error generating TTS for message {results[i]['id']}: {error}")
+                    del results[i]
                     continue
+                self._store_generated(key, output_path)
+                print(f"Generated: {output_path}")
+
+        for i, key, output_path in duplicates:
+            if not self._fetch_existing(key, output_path):
+                print(f"Error generating TTS for message {results[i]['id']}: duplicate of a failed message")
+                del results[i]
+
+        ordered = sorted(results.items())
+        with open(self.progress_path(scenario_name), 'wb') as progress:
+            for i, result in ordered:
+                self._write_progress(progress, i, result)
+        self._save_cache_index()
+        return [result for _, result in ordered]
+
+    async def generate_conversation_async(self, conversation: Sequence[Message], scenario_name: str = ''):
+        """Generate gTTS audio for an entire conversation with concurrent requests"""
+        async def fetch_and_write(index: int, message: Message) -> Optional[Dict]:
+            msg_id, role, text, filename = self._message_filename(message, index, scenario_name)
 
-                results.append({
-                    'id': msg_id,
-                    'role': role,
-                    'text': text,
-                    'audioPath': f'/tts/{filename}',
-                    'filename': filename,
-                    **{k: v for k, v in message.items() if k not in ['id', 'role', 'text']}
-                })
+            try:
+                await self.generate_with_gtts_async(text, filename, **self._gtts_params(role))
+                result = self._build_result(message, msg_id, role, text, filename)
+                # Recorded as soon as it completes, so an interrupt keeps it
+                self._write_progress(progress, index, result)
+                return result
             except Exception as e:
                 print(f"Error generating TTS for message {msg_id}: {e}")
+                return None
 
-        return results
-
-
-def create_sample_conversations():
-    """Create sample conversation scenarios - Customer and Seller"""
-    return {
-        "simple_order": [
-            {
-                "id": "msg-1",
-                "role": "seller",
-                "text": "Good morning! Welcome to our warung. What would you like to order today?"
-            },
-            {
-                "id": "msg-2",
-                "role": "customer",
-                "text": "Hi! I'd like two nasi goreng and one es teh manis please."
-            },
-            {
-                "id": "msg-3",
-                "role": "seller",
-                "text": "Perfect! I've added two nasi goreng at fifteen dollars each, and one es teh manis at five dollars. Would you like anything else?",
-                "orderAction": {
-                    "type": "add",
-                    "items": [
-                        {"name": "Nasi Goreng", "quantity": 2, "price": 15},
-                        {"name": "Es Teh Manis", "quantity": 1, "price": 5}
-                    ]
-                }
-            },
-            {
-                "id": "msg-4",
-                "role": "customer",
-                "text": "No, that's everything. Thank you!"
-            },
-            {
-                "id": "msg-5",
-                "role": "seller",
-                "text": "Wonderful! Your total comes to thirty five dollars."
-            },
-            {
-                "id": "msg-6",
-                "role": "customer",
-                "text": "Here's forty dollars cash."
-            },
-            {
-                "id": "msg-7",
-                "role": "seller",
-                "text": "Payment received! Your change is five dollars. Order complete! Have a great day!",
-                "paymentReceived": {
-                    "amount": 40,
-                    "change": 5,
-                    "method": "CASH"
-                }
-            }
-        ],
-        "negotiation": [
-            {
-                "id": "msg-1",
-                "role": "seller",
-                "text": "Hello! Welcome back. What can I prepare for you?"
-            },
-            {
-                "id": "msg-2",
-                "role": "customer",
-                "text": "I want three portions of sate ayam, please."
-            },
-            {
-                "id": "msg-3",
-                "role": "seller",
-                "text": "Sate ayam, excellent choice! I don't have a price set for that item yet. What price would you suggest?"
-            },
-            {
-                "id": "msg-4",
-                "role": "customer",
-                "text": "How about eight dollars per portion?"
-            },
-            {
-                "id": "msg-5",
-                "role": "seller",
-                "text": "Eight dollars sounds fair! I've added three sate ayam at eight dollars each. That's twenty four dollars total. Anything else?",
-                "orderAction": {
-                    "type": "add",
-                    "items": [
-                        {"name": "Sate Ayam", "quantity": 3, "price": 8}
-                    ]
-                }
-            },
-            {
-                "id": "msg-6",
-                "role": "customer",
-                "text": "Yes, add two es kopi susu."
-            },
-            {
-                "id": "msg-7",
-                "role": "seller",
-                "text": "Es kopi susu, great! I need a price for that as well. What would be reasonable?"
-            },
-            {
-                "id": "msg-8",
-                "role": "customer",
-                "text": "Let's say four fifty each."
-            },
-            {
-                "id": "msg-9",
-                "role": "seller",
-                "text": "Perfect! Added two es kopi susu at four fifty each. Your new total is thirty three dollars. Anything more?",
-                "orderAction": {
-                    "type": "add",
-                    "items": [
-                        {"name": "Es Kopi Susu", "quantity": 2, "price": 4.5}
-                    ]
-                }
-            },
-            {
-                "id": "msg-10",
-                "role": "customer",
-                "text": "That's all, thanks!"
-            },
-            {
-                "id": "msg-11",
-                "role": "seller",
-                "text": "Excellent! Your final total is thirty three dollars."
-            },
-            {
-                "id": "msg-12",
-                "role": "customer",
-                "text": "Here's forty dollars cash."
-            },
-            {
-                "id": "msg-13",
-                "role": "seller",
-                "text": "Payment received! Your change is seven dollars. Order complete! Thank you and see you again!",
-                "paymentReceived": {
-                    "amount": 40,
-                    "change": 7,
-                    "method": "CASH"
-                }
-            }
-        ],
-        "complex_order": [
-            {
-                "id": "msg-1",
-                "role": "seller",
-                "text": "Good afternoon! Ready to take your order. What would you like?"
-            },
-            {
-                "id": "msg-2",
-                "role": "customer",
-                "text": "I need five nasi goreng, three ayam goreng, and two soto ayam."
-            },
-            {
-                "id": "msg-3",
-                "role": "seller",
-                "text": "Got it! I've added five nasi goreng at fifteen dollars each, three ayam goreng at twelve dollars each, and two soto ayam at ten dollars each. Anything else?",
-                "orderAction": {
-                    "type": "add",
-                    "items": [
-                        {"name": "Nasi Goreng", "quantity": 5, "price": 15},
-                        {"name": "Ayam Goreng", "quantity": 3, "price": 12},
-                        {"name": "Soto Ayam", "quantity": 2, "price": 10}
-                    ]
-                }
-            },
-            {
-                "id": "msg-4",
-                "role": "customer",
-                "text": "Actually, make the nasi goreng just three portions instead."
-            },
-            {
-                "id": "msg-5",
-                "role": "seller",
-                "text": "No problem! Updated nasi goreng to three portions. Your current total is one hundred one dollars.",
-                "orderAction": {
-                    "type": "update",
-                    "items": [
-                        {"name": "Nasi Goreng", "quantity": 3, "price": 15}
-                    ]
-                }
-            },
-            {
-                "id": "msg-6",
-                "role": "customer",
-                "text": "And add four jus mangga please."
-            },
-            {
-                "id": "msg-7",
-                "role": "seller",
-                "text": "Excellent! I've added four jus mangga at five dollars each. Your total is now one hundred twenty one dollars. Anything more?",
-                "orderAction": {
-                    "type": "add",
-                    "items": [
-                        {"name": "Jus Mangga", "quantity": 4, "price": 5}
-                    ]
-                }
-            },
-            {
-                "id": "msg-8",
-                "role": "customer",
-                "text": "Can you also add two kerupuk? How much are those?"
-            },
-            {
-                "id": "msg-9",
-                "role": "seller",
-                "text": "I don't have a price for kerupuk yet. What would you like to pay for them?"
-            },
-            {
-                "id": "msg-10",
-                "role": "customer",
-                "text": "Two dollars each is fine."
-            },
-            {
-                "id": "msg-11",
-                "role": "seller",
-                "text": "Perfect! Added two kerupuk at two dollars each. Your final total is one hundred twenty five dollars. That's everything?",
-                "orderAction": {
-                    "type": "add",
-                    "items": [
-                        {"name": "Kerupuk", "quantity": 2, "price": 2}
-                    ]
-                }
-            },
-            {
-                "id": "msg-12",
-                "role": "customer",
-                "text": "Yes, that's all. Thank you!"
-            },
-            {
-                "id": "msg-13",
-                "role": "seller",
-                "text": "Wonderful! One hundred twenty five dollars total."
-            },
-            {
-                "id": "msg-14",
-                "role": "customer",
-                "text": "Here's one hundred fifty dollars cash."
-            },
-            {
-                "id": "msg-15",
-                "role": "seller",
-                "text": "Payment received! Your change is twenty five dollars. Order complete! Thank you for visiting!",
-                "paymentReceived": {
-                    "amount": 150,
-                    "change": 25,
-                    "method": "CASH"
-                }
-            }
-        ]
-    }
+        # Synthesize each distinct message once; repeats are linked afterwards
+        unique, duplicates = {}, []
+        for i, message in enumerate(conversation):
+            if not message.text:
+                continue
+            key = self._cache_key(message.text, engine='gtts', **self._gtts_params(message.role))
+            if key in unique:
+                duplicates.append(i)
+            else:
+                unique[key] = i
+
+        with open(self.progress_path(scenario_name), 'wb') as progress:
+            results = await asyncio.gather(*[fetch_and_write(i, conversation[i]) for i in unique.values()])
+            results = dict(zip(unique.values(), results))
+            for i in duplicates:
+                results[i] = await fetch_and_write(i, conversation[i])
+
+        ordered = [results[i] for i in sorted(results) if results[i]]
+        self._save_cache_index()
+        return ordered
+
+
+@functools.cache
+def create_sample_conversations() -> Mapping[str, Tuple[Message, ...]]:
+    """Create sample conversation scenarios - Customer and Seller
+
+    Built once and returned as a read-only mapping of message tuples.
+    """
+    return MappingProxyType({
+        "simple_order": (
+            Message("msg-1", "seller", "Good morning! Welcome to our warung. What would you like to order today?"),
+            Message("msg-2", "customer", "Hi! I'd like two nasi goreng and one es teh manis please."),
+            Message(
+                "msg-3", "seller",
+                "Perfect! I've added two nasi goreng at fifteen dollars each, and one es teh manis at five dollars. Would you like anything else?",
+                order_action=OrderAction("add", [
+                    OrderItem("Nasi Goreng", quantity=2, price=15),
+                    OrderItem("Es Teh Manis", quantity=1, price=5)
+                ])
+            ),
+            Message("msg-4", "customer", "No, that's everything. Thank you!"),
+            Message("msg-5", "seller", "Wonderful! Your total comes to thirty five dollars."),
+            Message("msg-6", "customer", "Here's forty dollars cash."),
+            Message(
+                "msg-7", "seller",
+                "Payment received! Your change is five dollars. Order complete! Have a great day!",
+                payment_received=Payment(amount=40, change=5, method="CASH")
+            )
+        ),
+        "negotiation": (
+            Message("msg-1", "seller", "Hello! Welcome back. What can I prepare for you?"),
+            Message("msg-2", "customer", "I want three portions of sate ayam, please."),
+            Message("msg-3", "seller", "Sate ayam, excellent choice! I don't have a price set for that item yet. What price would you suggest?"),
+            Message("msg-4", "customer", "How about eight dollars per portion?"),
+            Message(
+                "msg-5", "seller",
+                "Eight dollars sounds fair! I've added three sate ayam at eight dollars each. That's twenty four dollars total. Anything else?",
+                order_action=OrderAction("add", [
+                    OrderItem("Sate Ayam", quantity=3, price=8)
+                ])
+            ),
+            Message("msg-6", "customer", "Yes, add two es kopi susu."),
+            Message("msg-7", "seller", "Es kopi susu, great! I need a price for that as well. What would be reasonable?"),
+            Message("msg-8", "customer", "Let's say four fifty each."),
+            Message(
+                "msg-9", "seller",
+                "Perfect! Added two es kopi susu at four fifty each. Your new total is thirty three dollars. Anything more?",
+                order_action=OrderAction("add", [
+                    OrderItem("Es Kopi Susu", quantity=2, price=4.5)
+                ])
+            ),
+            Message("msg-10", "customer", "That's all, thanks!"),
+            Message("msg-11", "seller", "Excellent! Your final total is thirty three dollars."),
+            Message("msg-12", "customer", "Here's forty dollars cash."),
+            Message(
+                "msg-13", "seller",
+                "Payment received! Your change is seven dollars. Order complete! Thank you and see you again!",
+                payment_received=Payment(amount=40, change=7, method="CASH")
+            )
+        ),
+        "complex_order": (
+            Message("msg-1", "seller", "Good afternoon! Ready to take your order. What would you like?"),
+            Message("msg-2", "customer", "I need five nasi goreng, three ayam goreng, and two soto ayam."),
+            Message(
+                "msg-3", "seller",
+                "Got it! I've added five nasi goreng at fifteen dollars each, three ayam goreng at twelve dollars each, and two soto ayam at ten dollars each. Anything else?",
+                order_action=OrderAction("add", [
+                    OrderItem("Nasi Goreng", quantity=5, price=15),
+                    OrderItem("Ayam Goreng", quantity=3, price=12),
+                    OrderItem("Soto Ayam", quantity=2, price=10)
+                ])
+            ),
+            Message("msg-4", "customer", "Actually, make the nasi goreng just three portions instead."),
+            Message(
+                "msg-5", "seller",
+                "No problem! Updated nasi goreng to three portions. Your current total is one hundred one dollars.",
+                order_action=OrderAction("update", [
+                    OrderItem("Nasi Goreng", quantity=3, price=15)
+                ])
+            ),
+            Message("msg-6", "customer", "And add four jus mangga please."),
+            Message(
+                "msg-7", "seller",
+                "Excellent! I've added four jus mangga at five dollars each. Your total is now one hundred twenty one dollars. Anything more?",
+                order_action=OrderAction("add", [
+                    OrderItem("Jus Mangga", quantity=4, price=5)
+                ])
+            ),
+            Message("msg-8", "customer", "Can you also add two kerupuk? How much are those?"),
+            Message("msg-9", "seller", "I don't have a price for kerupuk yet. What would you like to pay for them?"),
+            Message("msg-10", "customer", "Two dollars each is fine."),
+            Message(
+                "msg-11", "seller",
+                "Perfect! Added two kerupuk at two dollars each. Your final total is one hundred twenty five dollars. That's everything?",
+                order_action=OrderAction("add", [
+                    OrderItem("Kerupuk", quantity=2, price=2)
+                ])
+            ),
+            Message("msg-12", "customer", "Yes, that's all. Thank you!"),
+            Message("msg-13", "seller", "Wonderful! One hundred twenty five dollars total."),
+            Message("msg-14", "customer", "Here's one hundred fifty dollars cash."),
+            Message(
+                "msg-15", "seller",
+                "Payment received! Your change is twenty five dollars. Order complete! Thank you for visiting!",
+                payment_received=Payment(amount=150, change=25, method="CASH")
+            )
+        )
+    })
+
+
+def merge_progress(generator: TTSGenerator, scenarios, metadata_path: Path):
+    """Merge per-scenario JSONL files into a single compact JSON object,
+    restoring message order from the index on each line"""
+    # Merge into a temp file and swap it in, so an interrupted merge leaves
+    # both the previous metadata and the JSONL progress files intact
+    tmp_path = metadata_path.with_suffix('.json.tmp')
+    with open(tmp_path, 'wb') as out:
+        out.write(b'{')
+        for n, scenario in enumerate(scenarios):
+            progress_path = generator.progress_path(scenario)
+            if n:
+                out.write(b',')
+            out.write(_dumps(scenario) + b':[')
+            # Lines are "[index,{...}]"; the result bytes are copied as-is
+            with open(progress_path, 'rb') as progress:
+                lines = sorted(
+                    (int(index), result)
+                    for index, _, result in (line.rstrip(b'\n')[1:-1].partition(b',') for line in progress)
+                )
+            out.write(b','.join(result for _, result in lines))
+            out.write(b']')
+        out.write(b'}')
+    os.replace(tmp_path, metadata_path)
+
+    for scenario in scenarios:
+        generator.progress_path(scenario).unlink()
+
+
+async def generate_scenarios_async(generator: TTSGenerator, conversations: Dict, scenarios) -> int:
+    """Generate gTTS audio for several scenarios, keeping one HTTP client open throughout"""
+    generated = 0
+    try:
+        for scenario in scenarios:
+            print(f"\nGenerating TTS for scenario: {scenario}")
+            results = await generator.generate_conversation_async(conversations[scenario], scenario_name=scenario)
+            generated += len(results)
+    finally:
+        await generator.aclose()
+    return generated
 
 
 def main():
@@ -366,6 +724,10 @@ def main():
                         help='Output directory for audio files')
     parser.add_argument('--engine', type=str, choices=['gtts', 'pyttsx3', 'auto'],
                         default='auto', help='TTS engine to use')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help=f'Directory for cached audio (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--max-cache-mb', type=int, default=DEFAULT_MAX_CACHE_BYTES // (1024 * 1024),
+                        help='Maximum cache size in MB before least recently used files are evicted')
 
     args = parser.parse_args()
 
@@ -389,7 +751,11 @@ def main():
         use_gtts = False
 
     # Initialize generator
-    generator = TTSGenerator(output_dir=args.output_dir)
+    generator = TTSGenerator(
+        output_dir=args.output_dir,
+        cache_dir=args.cache_dir,
+        max_cache_bytes=args.max_cache_mb * 1024 * 1024
+    )
 
     # Get conversations
     conversations = create_sample_conversations()
@@ -397,19 +763,23 @@ def main():
     # Generate TTS
     scenarios_to_generate = [args.scenario] if args.scenario != 'all' else conversations.keys()
 
-    all_results = {}
-    for scenario in scenarios_to_generate:
-        print(f"\nGenerating TTS for scenario: {scenario}")
-        conversation = conversations[scenario]
-        results = generator.generate_conversation(conversation, scenario_name=scenario, use_gtts=use_gtts)
-        all_results[scenario] = results
+    # Results are written per scenario to JSONL as they finish, so an
+    # interrupted run leaves usable partial metadata behind
+    if use_gtts and HTTPX_AVAILABLE:
+        generated = asyncio.run(generate_scenarios_async(generator, conversations, scenarios_to_generate))
+    else:
+        generated = 0
+        for scenario in scenarios_to_generate:
+            print(f"\nGenerating TTS for scenario: {scenario}")
+            conversation = conversations[scenario]
+            results = generator.generate_conversation(conversation, scenario_name=scenario, use_gtts=use_gtts)
+            generated += len(results)
 
     # Save metadata
     metadata_path = Path(args.output_dir) / 'conversations.json'
-    with open(metadata_path, 'w') as f:
-        json.dump(all_results, f, indent=2)
+    merge_progress(generator, scenarios_to_generate, metadata_path)
 
-    print(f"\nAll done! Generated {sum(len(r) for r in all_results.values())} audio files")
+    print(f"\nAll done! Generated {generated} audio files")
     print(f"Metadata saved to: {metadata_path}")
 
 
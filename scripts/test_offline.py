@@ -4,184 +4,361 @@ Offline Test Script for Conversation Simulation
 Tests the conversation flow without hitting external APIs
 """
 
+import functools
 import json
+import os
+import sys
+from collections import deque
+from itertools import chain, islice
 from pathlib import Path
 
+import fastjsonschema
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 TTS_DIR = Path(__file__).parent.parent / "public" / "tts"
 
-def load_conversations():
-    """Load conversation scenarios from JSON"""
+# Below this many scenarios, starting worker processes (which re-import this
+# module and recompile the validators) costs more than it saves
+POOL_MIN_SCENARIOS = 8
+
+# Structural contract for a single conversation message. Soft checks
+# (audio files, missing prices, change arithmetic) stay in Python.
+MESSAGE_SCHEMA = {
+    "type": "object",
+    "required": ["role", "text"],
+    "properties": {
+        "id": {"type": "string"},
+        "role": {"enum": ["customer", "seller"]},
+        "text": {"type": "string", "minLength": 1},
+        "audioPath": {"type": "string"},
+        "orderAction": {
+            "type": "object",
+            "required": ["type"],
+            "properties": {
+                "type": {"enum": ["add", "update", "remove"]},
+                "items": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "required": ["name", "quantity"],
+                        "properties": {
+                            "name": {"type": "string"},
+                            "quantity": {"type": "integer"},
+                            "price": {"type": ["number", "null"]}
+                        }
+                    }
+                }
+            }
+        },
+        "paymentReceived": {
+            "type": "object",
+            "required": ["amount", "change"],
+            "properties": {
+                "amount": {"type": "number"},
+                "change": {"type": "number"},
+                "method": {"type": "string"}
+            }
+        }
+    }
+}
+
+_validate_message = fastjsonschema.compile(MESSAGE_SCHEMA)
+
+# fastjsonschema stops at the first error, so a message that fails the full
+# schema is re-checked one field at a time. That reports every bad field and
+# lets order and payment processing depend only on their own sub-schema.
+# They are only compiled once a message actually fails.
+@functools.cache
+def _field_validators() -> dict:
+    return {
+        key: fastjsonschema.compile({
+            "type": "object",
+            "required": [key] if key in MESSAGE_SCHEMA["required"] else [],
+            "properties": {key: subschema}
+        })
+        for key, subschema in MESSAGE_SCHEMA["properties"].items()
+    }
+
+def _invalid_fields(msg, msg_id: str, errors: list) -> set:
+    """Return the fields of msg that break the schema, recording an error for each"""
+    try:
+        _validate_message(msg)
+        return set()
+    except fastjsonschema.JsonSchemaException:
+        pass
+
+    invalid = set()
+    for key, validate in _field_validators().items():
+        try:
+            validate(msg)
+        except fastjsonschema.JsonSchemaException as e:
+            errors.append(f"[{msg_id}] {e.message}")
+            invalid.add(key)
+    return invalid
+
+_ROLE_ICONS = {'customer': '👤', 'seller': '🏪'}
+_MSG_TMPL = "\n{icon} [{id}] {role_up}: {preview}{ellipsis}"
+
+def iter_conversations():
+    """Yield (scenario_name, scenario) pairs from JSON, one scenario in memory at a time"""
     conversations_path = TTS_DIR / "conversations.json"
     if not conversations_path.exists():
         print(f"Error: {conversations_path} not found")
-        return None
+        return
 
-    with open(conversations_path, 'r') as f:
-        return json.load(f)
+    if ijson is None:
+        yield from _loads(conversations_path.read_bytes()).items()
+        return
 
-def validate_conversation(scenario_name: str, scenario: list):
-    """Validate a conversation scenario structure"""
-    print(f"\n{'='*60}")
-    print(f"Validating Scenario: {scenario_name}")
-    print(f"{'='*60}")
+    with open(conversations_path, 'rb') as f:
+        # use_float keeps prices as floats rather than Decimal for the schema
+        yield from ijson.kvitems(f, '', use_float=True)
+
+def list_audio_files():
+    """Snapshot the audio filenames in TTS_DIR with a single directory scan"""
+    if not TTS_DIR.exists():
+        return set()
+    return {entry.name for entry in os.scandir(TTS_DIR) if entry.is_file()}
+
+def check_conversation(scenario_name: str, scenario: list, audio_files: set):
+    """Validate a conversation scenario structure, returning (is_valid, report_text)"""
+    # Output is buffered and returned as one block per scenario
+    out = []
+    out.append(f"\n{'='*60}")
+    out.append(f"Validating Scenario: {scenario_name}")
+    out.append(f"{'='*60}")
 
     errors = []
     warnings = []
 
     # Track order state
-    current_order = []
+    current_order: dict[str, dict] = {}
+    order_total = 0
     has_payment = False
 
+    # Summary counters, filled in during the main pass
+    n_customer = n_seller = n_order_actions = 0
+
     for i, msg in enumerate(scenario):
         msg_id = msg.get('id', f'msg-{i}')
         role = msg.get('role')
         text = msg.get('text')
         audio_path = msg.get('audioPath')
 
-        # Validate required fields
-        if not role:
-            errors.append(f"[{msg_id}] Missing 'role' field")
-        elif role not in ['customer', 'seller']:
-            errors.append(f"[{msg_id}] Invalid role: '{role}' (expected 'customer' or 'seller')")
+        if role == 'customer':
+            n_customer += 1
+        elif role == 'seller':
+            n_seller += 1
+        if 'orderAction' in msg:
+            n_order_actions += 1
 
-        if not text:
-            errors.append(f"[{msg_id}] Missing 'text' field")
+        # Validate message structure
+        invalid = _invalid_fields(msg, msg_id, errors)
+        order_valid = 'orderAction' in msg and 'orderAction' not in invalid
+        payment_valid = 'paymentReceived' in msg and 'paymentReceived' not in invalid
 
         if not audio_path:
             warnings.append(f"[{msg_id}] Missing 'audioPath' field")
         else:
             # Check if audio file exists
-            audio_file = TTS_DIR / Path(audio_path).name
-            if not audio_file.exists():
+            if audio_path.rsplit('/', 1)[-1] not in audio_files:
                 warnings.append(f"[{msg_id}] Audio file not found: {audio_path}")
 
         # Process order actions
-        if 'orderAction' in msg:
+        if order_valid:
             action = msg['orderAction']
-            action_type = action.get('type')
+            action_type = action['type']
             items = action.get('items', [])
 
-            if action_type not in ['add', 'update', 'remove']:
-                errors.append(f"[{msg_id}] Invalid orderAction type: '{action_type}'")
-
             for item in items:
-                if 'name' not in item:
-                    errors.append(f"[{msg_id}] Order item missing 'name'")
-                if 'quantity' not in item:
-                    errors.append(f"[{msg_id}] Order item missing 'quantity'")
                 if 'price' not in item:
                     warnings.append(f"[{msg_id}] Order item missing 'price'")
 
-            # Update order state
+            # Update order state, keyed by lowercased item name. The schema
+            # guarantees name and quantity, so they are indexed directly.
             if action_type == 'add':
                 for item in items:
-                    existing = next((o for o in current_order if o['name'].lower() == item['name'].lower()), None)
-                    if existing:
-                        existing['quantity'] += item.get('quantity', 1)
+                    key = item['name'].lower()
+                    quantity = item['quantity']
+                    if key in current_order:
+                        current_order[key]['quantity'] += quantity
                     else:
-                        current_order.append({
+                        current_order[key] = {
                             'name': item['name'],
-                            'quantity': item.get('quantity', 1),
-                            'price': item.get('price', 0)
-                        })
+                            'quantity': quantity,
+                            # Unpriced items count as 0 so totals need no per-use checks
+                            'price': item.get('price') or 0
+                        }
+                    order_total += current_order[key]['price'] * quantity
             elif action_type == 'update':
                 for item in items:
-                    existing = next((o for o in current_order if o['name'].lower() == item['name'].lower()), None)
+                    existing = current_order.get(item['name'].lower())
                     if existing:
-                        existing['quantity'] = item.get('quantity', existing['quantity'])
+                        quantity = item['quantity']
+                        order_total += existing['price'] * (quantity - existing['quantity'])
+                        existing['quantity'] = quantity
             elif action_type == 'remove':
                 for item in items:
-                    current_order = [o for o in current_order if o['name'].lower() != item['name'].lower()]
+                    removed = current_order.pop(item['name'].lower(), None)
+                    if removed:
+                        order_total -= removed['price'] * removed['quantity']
 
         # Check for payment
         if 'paymentReceived' in msg:
-            payment = msg['paymentReceived']
             has_payment = True
 
-            if 'amount' not in payment:
-                errors.append(f"[{msg_id}] Payment missing 'amount'")
-            if 'change' not in payment:
-                errors.append(f"[{msg_id}] Payment missing 'change'")
+        if payment_valid:
+            payment = msg['paymentReceived']
+
             if 'method' not in payment:
                 warnings.append(f"[{msg_id}] Payment missing 'method'")
 
             # Validate payment amount
             if current_order:
-                total = sum((item.get('price', 0) or 0) * item['quantity'] for item in current_order)
-                expected_change = payment.get('amount', 0) - total
-                actual_change = payment.get('change', 0)
+                expected_change = payment['amount'] - order_total
+                actual_change = payment['change']
 
                 if abs(expected_change - actual_change) > 0.01:
                     warnings.append(f"[{msg_id}] Change mismatch: expected ${expected_change:.2f}, got ${actual_change:.2f}")
 
         # Print message
-        role_icon = "👤" if role == 'customer' else "🏪"
-        print(f"\n{role_icon} [{msg_id}] {role.upper()}: {text[:60]}{'...' if len(text) > 60 else ''}")
-
-        if 'orderAction' in msg:
+        text = text or ''
+        out.append(_MSG_TMPL.format_map({
+            'icon': _ROLE_ICONS.get(role, '❓'),
+            'id': msg_id,
+            'role_up': str(role).upper(),
+            'preview': text[:60],
+            'ellipsis': '...' if len(text) > 60 else ''
+        }))
+
+        if order_valid:
             action = msg['orderAction']
-            print(f"   📦 Order Action: {action['type']}")
+            out.append(f"   📦 Order Action: {action['type']}")
             for item in action.get('items', []):
-                print(f"      - {item.get('quantity', 1)}x {item['name']} @ ${item.get('price', 'TBD')}")
+                out.append(f"      - {item['quantity']}x {item['name']} @ ${item['price'] if 'price' in item else 'TBD'}")
 
-        if 'paymentReceived' in msg:
+        if payment_valid:
             payment = msg['paymentReceived']
-            print(f"   💰 Payment: ${payment.get('amount', 0)} received, ${payment.get('change', 0)} change")
+            out.append(f"   💰 Payment: ${payment['amount']} received, ${payment['change']} change")
 
     # Final validation
     if not has_payment:
         warnings.append("Scenario does not end with payment")
 
     # Print summary
-    print(f"\n{'-'*60}")
-    print(f"Validation Summary for '{scenario_name}':")
-    print(f"  Messages: {len(scenario)}")
-    print(f"  Customer messages: {sum(1 for m in scenario if m.get('role') == 'customer')}")
-    print(f"  Seller messages: {sum(1 for m in scenario if m.get('role') == 'seller')}")
-    print(f"  Order actions: {sum(1 for m in scenario if 'orderAction' in m)}")
-    print(f"  Has payment: {'Yes' if has_payment else 'No'}")
+    out.append(f"\n{'-'*60}")
+    out.append(f"Validation Summary for '{scenario_name}':")
+    out.append(f"  Messages: {len(scenario)}")
+    out.append(f"  Customer messages: {n_customer}")
+    out.append(f"  Seller messages: {n_seller}")
+    out.append(f"  Order actions: {n_order_actions}")
+    out.append(f"  Has payment: {'Yes' if has_payment else 'No'}")
 
     if current_order:
-        total = sum((item.get('price', 0) or 0) * item['quantity'] for item in current_order)
-        print(f"\n  Final Order:")
-        for item in current_order:
-            subtotal = (item.get('price', 0) or 0) * item['quantity']
-            print(f"    - {item['quantity']}x {item['name']}: ${subtotal:.2f}")
-        print(f"  Total: ${total:.2f}")
+        out.append(f"\n  Final Order:")
+        for item in current_order.values():
+            subtotal = item['price'] * item['quantity']
+            out.append(f"    - {item['quantity']}x {item['name']}: ${subtotal:.2f}")
+        out.append(f"  Total: ${order_total:.2f}")
 
     if errors:
-        print(f"\n  ❌ Errors ({len(errors)}):")
+        out.append(f"\n  ❌ Errors ({len(errors)}):")
         for error in errors:
-            print(f"    - {error}")
+            out.append(f"    - {error}")
 
     if warnings:
-        print(f"\n  ⚠️ Warnings ({len(warnings)}):")
+        out.append(f"\n  ⚠️ Warnings ({len(warnings)}):")
         for warning in warnings:
-            print(f"    - {warning}")
+            out.append(f"    - {warning}")
 
     if not errors and not warnings:
-        print(f"\n  ✅ All validations passed!")
+        out.append(f"\n  ✅ All validations passed!")
     elif not errors:
-        print(f"\n  ✅ No errors found (but {len(warnings)} warnings)")
+        out.append(f"\n  ✅ No errors found (but {len(warnings)} warnings)")
+
+    return len(errors) == 0, "\n".join(out) + "\n"
+
+def validate_conversation(scenario_name: str, scenario: list, audio_files: set = None):
+    """Validate a conversation scenario structure and print the report"""
+    if audio_files is None:
+        audio_files = list_audio_files()
+
+    valid, report = check_conversation(scenario_name, scenario, audio_files)
+    sys.stdout.write(report)
+    sys.stdout.flush()
+    return valid
+
+# Audio filename snapshot, sent to each pool worker once by _init_worker
+_audio_files = set()
 
-    return len(errors) == 0
+def _init_worker(audio_files: set):
+    global _audio_files
+    _audio_files = audio_files
+
+def _validate_one(scenario_name: str, scenario: list):
+    """Process pool entry point: validate one scenario and return its report"""
+    valid, report = check_conversation(scenario_name, scenario, _audio_files)
+    return scenario_name, valid, report
 
 def main():
     print("="*60)
     print("Offline Conversation Validation Test")
     print("="*60)
 
-    conversations = load_conversations()
-    if not conversations:
-        return
-
-    print(f"\nFound {len(conversations)} scenarios: {', '.join(conversations.keys())}")
+    audio_files = list_audio_files()
 
     all_valid = True
-    for scenario_name, scenario in conversations.items():
-        if not validate_conversation(scenario_name, scenario):
+    scenario_names = []
+    max_workers = os.cpu_count() or 1
+
+    def show(scenario_name, valid, report):
+        nonlocal all_valid
+        scenario_names.append(scenario_name)
+        sys.stdout.write(report)
+        sys.stdout.flush()
+        if not valid:
             all_valid = False
 
+    # Only a few scenarios are read ahead to decide whether a process pool
+    # is worth starting; the rest are still streamed from JSON
+    conversations = iter_conversations()
+    head = list(islice(conversations, POOL_MIN_SCENARIOS))
+    conversations = chain(head, conversations)
+
+    if max_workers == 1 or len(head) < POOL_MIN_SCENARIOS:
+        for name, scenario in conversations:
+            show(name, *check_conversation(name, scenario, audio_files))
+    else:
+        # Scenarios are independent, so they are validated in parallel. Only
+        # a bounded window is in flight, so scenarios are still read one at a
+        # time as results come back. Reports are printed in input order by
+        # this process only.
+        from concurrent.futures import ProcessPoolExecutor
+
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(audio_files,)) as executor:
+            for name, scenario in conversations:
+                pending.append(executor.submit(_validate_one, name, scenario))
+                if len(pending) >= 2 * max_workers:
+                    show(*pending.popleft().result())
+            while pending:
+                show(*pending.popleft().result())
+
+    if not scenario_names:
+        return
+
+    print(f"\nValidated {len(scenario_names)} scenarios: {', '.join(scenario_names)}")
     print(f"\n{'='*60}")
     if all_valid:
         print("✅ All scenarios validated successfully!")
@@ -4,15 +4,67 @@ Test Script for Conversation Simulation
 Simulates the conversation flow and tests API endpoints
 """
 
+import concurrent.futures
+import io
 import json
+import pickle
+import struct
+import sys
 import time
 import requests
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+
+    def _pretty(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+    def _pretty(obj) -> str:
+        return json.dumps(obj, indent=2)
 
 # Configuration
 BASE_URL = "http://localhost:3000"
+
+# Print full API responses; turned off with --quiet
+VERBOSE = True
+
+_BAR = '=' * 60
+_HASH = '#' * 60
 TTS_DIR = Path(__file__).parent.parent / "public" / "tts"
 
+# Parsed conversations.json, reused while the file's mtime and size match.
+# Kept outside public/ so it is never served by the web app.
+CONVERSATIONS_CACHE = Path(__file__).parent / ".tts_cache" / "conversations.pkl"
+_CACHE_HEADER = struct.Struct('<qq')
+
+# Scenarios simulated concurrently under --scenario all
+MAX_WORKERS = 8
+
+# One keep-alive session for every API call, so requests reuse the
+# connection to the dev server instead of reconnecting each time. The
+# pool holds one connection per concurrent scenario.
+_SESSION = requests.Session()
+_SESSION.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+# Responses come over loopback, so compressing them only costs CPU on both ends
+_SESSION.headers['Accept-Encoding'] = 'identity'
+
+# Request bodies are serialized up front, so the JSON content type is explicit
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
 def load_conversations():
     """Load conversation scenarios from JSON"""
     conversations_path = TTS_DIR / "conversations.json"
@@ -20,74 +72,98 @@ def load_conversations():
         print(f"Error: {conversations_path} not found")
         return None
 
-    with open(conversations_path, 'r') as f:
-        return json.load(f)
+    st = conversations_path.stat()
+    header = _CACHE_HEADER.pack(st.st_mtime_ns, st.st_size)
+
+    try:
+        with open(CONVERSATIONS_CACHE, 'rb') as f:
+            if f.read(_CACHE_HEADER.size) == header:
+                return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
 
-def test_parse_order(transcript: str, current_order: list = None):
+    conversations = _loads(conversations_path.read_bytes())
+    try:
+        CONVERSATIONS_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        with open(CONVERSATIONS_CACHE, 'wb') as f:
+            f.write(header)
+            pickle.dump(conversations, f, protocol=5)
+    except OSError:
+        pass
+    return conversations
+
+def test_parse_order(transcript: str, current_order: list = None, out=None):
     """Test the parse-order API endpoint"""
     if current_order is None:
         current_order = []
+    out = out or sys.stdout
 
-    print(f"\n{'='*60}")
-    print(f"Testing Parse Order API")
-    print(f"{'='*60}")
-    print(f"Transcript: \"{transcript}\"")
-    print(f"Current Order: {current_order}")
+    print("\n" + _BAR, file=out)
+    print(f"Testing Parse Order API", file=out)
+    print(_BAR, file=out)
+    print(f"Transcript: \"{transcript}\"", file=out)
+    print(f"Current Order: {current_order}", file=out)
 
     try:
-        response = requests.post(
+        response = _SESSION.post(
             f"{BASE_URL}/api/parse-order",
-            json={
+            data=_dumps({
                 "transcript": transcript,
                 "currentOrderItems": current_order
-            },
-            headers={"Content-Type": "application/json"},
+            }),
+            headers=_JSON_HEADERS,
             timeout=30
         )
 
-        print(f"\nStatus Code: {response.status_code}")
+        print(f"\nStatus Code: {response.status_code}", file=out)
 
         if response.ok:
-            result = response.json()
-            print(f"\n✅ Parse Result:")
-            print(json.dumps(result, indent=2))
+            result = _loads(response.content)
+            if VERBOSE:
+                print(f"\n✅ Parse Result:", file=out)
+                print(_pretty(result), file=out)
             return result
         else:
-            print(f"\n❌ Error: {response.text}")
+            print(f"\n❌ Error: {response.text}", file=out)
             return None
 
     except requests.exceptions.ConnectionError:
-        print(f"\n❌ Connection Error: Make sure the dev server is running at {BASE_URL}")
+        print(f"\n❌ Connection Error: Make sure the dev server is running at {BASE_URL}", file=out)
         return None
     except Exception as e:
-        print(f"\n❌ Error: {e}")
+        print(f"\n❌ Error: {e}", file=out)
         return None
 
-def simulate_conversation(scenario_name: str, conversations: dict):
-    """Simulate a conversation scenario"""
+def simulate_conversation(scenario_name: str, conversations: dict, out=None, delay: float = 0.0):
+    """Simulate a conversation scenario, printing to out (stdout by default)
+
+    delay adds a pause in seconds after each message to mimic a real conversation.
+    """
+    out = out or sys.stdout
     if scenario_name not in conversations:
-        print(f"Error: Scenario '{scenario_name}' not found")
+        print(f"Error: Scenario '{scenario_name}' not found", file=out)
         return
 
     scenario = conversations[scenario_name]
 
-    print(f"\n{'#'*60}")
-    print(f"# Simulating Scenario: {scenario_name}")
-    print(f"{'#'*60}")
+    print("\n" + _HASH, file=out)
+    print(f"# Simulating Scenario: {scenario_name}", file=out)
+    print(_HASH, file=out)
 
-    current_order = []
+    # Order items keyed by lowercased name, in insertion order
+    current_order: dict[str, dict] = {}
 
     for msg in scenario:
         role = msg.get('role', 'unknown')
         text = msg.get('text', '')
         msg_id = msg.get('id', 'unknown')
 
-        print(f"\n[{msg_id}] {role.upper()}: {text}")
+        print(f"\n[{msg_id}] {role.upper()}: {text}", file=out)
 
         # If customer message, test the parse-order API
         if role == 'customer':
             # Simulate sending to parse-order API
-            result = test_parse_order(text, current_order)
+            result = test_parse_order(text, list(current_order.values()), out=out)
 
             if result:
                 # Update current order based on actions
@@ -96,25 +172,26 @@ def simulate_conversation(scenario_name: str, conversations: dict):
 
                 # Handle add actions
                 for item in actions.get('add', []) + items:
-                    existing = next((o for o in current_order if o['name'].lower() == item['name'].lower()), None)
+                    key = item['name'].lower()
+                    existing = current_order.get(key)
                     if existing:
                         existing['quantity'] += item.get('quantity', 1)
                     else:
-                        current_order.append({
+                        current_order[key] = {
                             'name': item['name'],
                             'quantity': item.get('quantity', 1),
                             'price': item.get('price')
-                        })
+                        }
 
                 # Handle update actions
                 for item in actions.get('update', []):
-                    existing = next((o for o in current_order if o['name'].lower() == item['name'].lower()), None)
+                    existing = current_order.get(item['name'].lower())
                     if existing:
                         existing['quantity'] = item.get('quantity', existing['quantity'])
 
                 # Handle remove actions
                 for item in actions.get('remove', []):
-                    current_order = [o for o in current_order if o['name'].lower() != item['name'].lower()]
+                    current_order.pop(item['name'].lower(), None)
 
         # Check for order actions in the message
         if 'orderAction' in msg:
@@ -122,40 +199,41 @@ def simulate_conversation(scenario_name: str, conversations: dict):
             action_type = action.get('type')
             items = action.get('items', [])
 
-            print(f"\n  📦 Order Action: {action_type}")
+            print(f"\n  📦 Order Action: {action_type}", file=out)
             for item in items:
-                print(f"     - {item['quantity']}x {item['name']} @ ${item.get('price', 'TBD')}")
+                print(f"     - {item['quantity']}x {item['name']} @ ${item.get('price', 'TBD')}", file=out)
 
         # Check for payment received
         if 'paymentReceived' in msg:
             payment = msg['paymentReceived']
-            print(f"\n  💰 Payment Received!")
-            print(f"     Amount: ${payment['amount']}")
-            print(f"     Change: ${payment['change']}")
-            print(f"     Method: {payment['method']}")
+            print(f"\n  💰 Payment Received!", file=out)
+            print(f"     Amount: ${payment['amount']}", file=out)
+            print(f"     Change: ${payment['change']}", file=out)
+            print(f"     Method: {payment['method']}", file=out)
 
-        # Small delay between messages
-        time.sleep(0.5)
+        # Optional pause between messages
+        if delay:
+            time.sleep(delay)
 
-    print(f"\n{'='*60}")
-    print(f"Simulation Complete!")
-    print(f"{'='*60}")
+    print("\n" + _BAR, file=out)
+    print(f"Simulation Complete!", file=out)
+    print(_BAR, file=out)
 
     # Print final order summary
     if current_order:
-        print(f"\nFinal Order:")
-        total = 0
-        for item in current_order:
-            subtotal = (item.get('price') or 0) * item['quantity']
-            total += subtotal
-            print(f"  - {item['quantity']}x {item['name']}: ${subtotal}")
-        print(f"\nTotal: ${total}")
+        lines = [
+            (item['quantity'], item['name'], (item.get('price') or 0) * item['quantity'])
+            for item in current_order.values()
+        ]
+        total = sum(subtotal for _, _, subtotal in lines)
+        summary = "\n".join(f"  - {quantity}x {name}: ${subtotal}" for quantity, name, subtotal in lines)
+        print(f"\nFinal Order:\n{summary}\n\nTotal: ${total}", file=out)
 
 def test_transcribe_api():
     """Test the transcribe API with a sample audio file"""
-    print(f"\n{'='*60}")
+    print("\n" + _BAR)
     print(f"Testing Transcribe API (Groq Whisper)")
-    print(f"{'='*60}")
+    print(_BAR)
 
     # Check if there's a sample audio file
     sample_audio = TTS_DIR / "msg-2_customer.mp3"
@@ -169,18 +247,29 @@ def test_transcribe_api():
 
     try:
         with open(sample_audio, 'rb') as f:
-            response = requests.post(
-                f"{BASE_URL}/api/transcribe",
-                files={'file': ('recording.webm', f, 'audio/webm')},
-                timeout=30
-            )
+            if MultipartEncoder:
+                # Stream the upload from the file instead of building the body in memory
+                body = MultipartEncoder(fields={'file': ('recording.webm', f, 'audio/webm')})
+                response = _SESSION.post(
+                    f"{BASE_URL}/api/transcribe",
+                    data=body,
+                    headers={'Content-Type': body.content_type},
+                    timeout=30
+                )
+            else:
+                response = _SESSION.post(
+                    f"{BASE_URL}/api/transcribe",
+                    files={'file': ('recording.webm', f, 'audio/webm')},
+                    timeout=30
+                )
 
         print(f"\nStatus Code: {response.status_code}")
 
         if response.ok:
-            result = response.json()
-            print(f"\n✅ Transcription Result:")
-            print(json.dumps(result, indent=2))
+            result = _loads(response.content)
+            if VERBOSE:
+                print(f"\n✅ Transcription Result:")
+                print(_pretty(result))
             return result
         else:
             print(f"\n❌ Error: {response.text}")
@@ -205,9 +294,16 @@ def main():
                         help='Test the transcribe API')
     parser.add_argument('--test-parse', type=str,
                         help='Test parse-order API with a custom transcript')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Seconds to pause between messages (default: no pause)')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Do not print full API responses')
 
     args = parser.parse_args()
 
+    global VERBOSE
+    VERBOSE = not args.quiet
+
     # Test transcribe API if requested
     if args.test_transcribe:
         test_transcribe_api()
@@ -225,11 +321,19 @@ def main():
 
     # Simulate scenarios
     if args.scenario == 'all':
-        for scenario_name in conversations.keys():
-            simulate_conversation(scenario_name, conversations)
-            print("\n" + "="*60 + "\n")
+        # Scenarios are independent and mostly wait on HTTP, so run them
+        # concurrently and print each buffered transcript in order
+        def run(scenario_name):
+            buffer = io.StringIO()
+            simulate_conversation(scenario_name, conversations, out=buffer, delay=args.delay)
+            return buffer.getvalue()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(conversations))) as executor:
+            for transcript in executor.map(run, conversations):
+                sys.stdout.write(transcript)
+                print("\n" + _BAR + "\n")
     else:
-        simulate_conversation(args.scenario, conversations)
+        simulate_conversation(args.scenario, conversations, delay=args.delay)
 
 if __name__ == '__main__':
     main()